@@ -1,8 +1,11 @@
 """
 Centralized management of API keys for the project.
 All API key loading functions are located here.
+Keys are cached after the first read, so repeated calls don't touch the disk.
 """
+from functools import lru_cache
 
+@lru_cache(maxsize=4)
 def get_stock_api_key(filepath):
     """Read the Alpha Vantage API key from the specified file."""
     with open(filepath, 'r', encoding='utf-8') as f:
@@ -11,6 +14,7 @@ def get_stock_api_key(filepath):
             raise ValueError(f"API key file '{filepath}' is empty.")
         return key
 
+@lru_cache(maxsize=4)
 def get_news_api_key(filepath):
     """Read TheNewsAPI key from the specified file."""
     with open(filepath, 'r', encoding='utf-8') as f:
@@ -19,6 +23,7 @@ def get_news_api_key(filepath):
             raise ValueError(f"API key file '{filepath}' is empty.")
         return key
 
+@lru_cache(maxsize=4)
 def get_marketstack_key(filepath):
     """Read the Marketstack API key from the specified file."""
     with open(filepath, 'r', encoding='utf-8') as f:
@@ -4,7 +4,7 @@ Adapted for first-year university level.
 """
 import os
 import sqlite3
-import pandas as pd
+from database import connect_db, stock_table_name
 
 # Output directory for calculation results
 OUTPUT_DIR = 'output'
@@ -26,32 +26,29 @@ def calculate_stock_summary(db_name, ticker_table):
         dict: Dictionary with basic statistics.
     """
     # Connect to database
-    conn = sqlite3.connect(db_name)
+    conn = connect_db(db_name)
     
-    # Query data
+    # Calculate basic statistics in SQL so only one summary row is loaded
     query = f"""
-        SELECT date, open, high, low, close, volume
-        FROM {ticker_table}
-        ORDER BY date
+        SELECT
+            COUNT(*) as count,
+            AVG(close) as close_avg,
+            MIN(close) as close_min,
+            MAX(close) as close_max,
+            AVG(volume) as volume_avg,
+            MIN(date) as start_date,
+            MAX(date) as end_date
+        FROM "{ticker_table}"
     """
     
-    # Load data into pandas DataFrame
-    df = pd.read_sql_query(query, conn)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute(query).fetchone()
     conn.close()
     
-    if df.empty:
+    if row['count'] == 0:
         return None
     
-    # Calculate basic statistics
-    stats = {
-        'count': len(df),
-        'close_avg': df['close'].mean(),
-        'close_min': df['close'].min(),
-        'close_max': df['close'].max(),
-        'volume_avg': df['volume'].mean(),
-        'start_date': df['date'].min(),
-        'end_date': df['date'].max()
-    }
+    stats = dict(row)
     
     return stats
 
@@ -66,30 +63,28 @@ def calculate_news_summary(db_name):
         dict: Dictionary with sentiment summary.
     """
     # Connect to database
-    conn = sqlite3.connect(db_name)
+    conn = connect_db(db_name)
     
-    # Query sentiment data
+    # Calculate simple summary statistics in SQL
     query = """
-        SELECT s.score
+        SELECT
+            COUNT(*) as count,
+            AVG(s.score) as score_avg,
+            MIN(s.score) as score_min,
+            MAX(s.score) as score_max
         FROM articles a
         JOIN sentiment s ON a.id = s.article_id
         WHERE s.score IS NOT NULL
     """
     
-    # Load data into pandas DataFrame
-    df = pd.read_sql_query(query, conn)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute(query).fetchone()
     conn.close()
     
-    if df.empty:
+    if row['count'] == 0:
         return None
     
-    # Calculate simple summary statistics
-    stats = {
-        'count': len(df),
-        'score_avg': df['score'].mean(),
-        'score_min': df['score'].min(),
-        'score_max': df['score'].max()
-    }
+    stats = dict(row)
     
     return stats
 
@@ -106,7 +101,7 @@ def run_all_calculations(db_name, ticker):
     """
     ensure_output_dir()
     output_files = []
-    stock_table = f"{ticker}_weekly_adjusted"
+    stock_table = stock_table_name(ticker)
     
     # 1. Calculate basic stock statistics
     stock_stats = calculate_stock_summary(db_name, stock_table)
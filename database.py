@@ -0,0 +1,97 @@
+"""
+Centralized SQLite connection handling for the project.
+All database connections are opened and configured here.
+"""
+import os
+import re
+import atexit
+import sqlite3
+
+# Stock tables are named after their ticker, which must be a plain identifier
+STOCK_TABLE_TEMPLATE = "{}_weekly_adjusted"
+TICKER_PATTERN = re.compile(r"[A-Za-z0-9_]{1,16}")
+
+# Open connections shared across calls, keyed by process ID and database file name
+_CONN_CACHE = {}
+
+def stock_table_name(ticker):
+    """
+    Get the table name for a ticker's weekly stock data.
+    
+    Table names can't be bound as query parameters, so the ticker is checked
+    before it is put into any SQL.
+    
+    Args:
+        ticker (str): Stock ticker symbol.
+        
+    Returns:
+        str: Name of the ticker's stock table.
+        
+    Raises:
+        ValueError: If the ticker contains characters other than letters,
+            digits and underscores, or is longer than 16 characters.
+    """
+    if not TICKER_PATTERN.fullmatch(ticker):
+        raise ValueError(f"Invalid ticker symbol: {ticker!r}")
+    return STOCK_TABLE_TEMPLATE.format(ticker)
+
+def configure_connection(conn):
+    """
+    Apply the project's performance PRAGMAs to a SQLite connection.
+    
+    WAL journaling with synchronous=NORMAL avoids an fsync on every commit,
+    while temporary tables and the page cache are kept in memory and reads
+    go through a memory map instead of read() calls.
+    
+    Args:
+        conn (sqlite3.Connection): Connection to configure.
+        
+    Returns:
+        sqlite3.Connection: The same connection, for chaining.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-131072")  # 128 MB page cache
+    conn.execute("PRAGMA mmap_size=268435456")  # Memory-map up to 256 MB of the file
+    return conn
+
+def connect_db(db_name):
+    """
+    Open a configured connection to the SQLite database.
+    
+    Args:
+        db_name (str): Database file name.
+        
+    Returns:
+        sqlite3.Connection: Configured database connection.
+    """
+    return configure_connection(sqlite3.connect(db_name))
+
+def get_connection(db_name):
+    """
+    Get a shared, configured connection to the SQLite database.
+    
+    The connection stays open for the life of the process, so SQLite's
+    prepared-statement cache is kept between calls. Callers must not close it.
+    Connections are never shared with child processes, which open their own.
+    
+    Args:
+        db_name (str): Database file name.
+        
+    Returns:
+        sqlite3.Connection: Cached database connection.
+    """
+    key = (os.getpid(), db_name)
+    conn = _CONN_CACHE.get(key)
+    if conn is None:
+        conn = configure_connection(sqlite3.connect(db_name, cached_statements=256))
+        _CONN_CACHE[key] = conn
+    return conn
+
+@atexit.register
+def close_connections():
+    """Close all cached connections opened by this process."""
+    pid = os.getpid()
+    for key in [key for key in _CONN_CACHE if key[0] == pid]:
+        _CONN_CACHE.pop(key).close()
@@ -99,19 +99,22 @@ def process_data():
     # Get counts before processing
     before_counts = get_current_counts()
     
-    # Process stock data for each ticker
+    # Process stock data for all tickers
     print("\nProcessing stock data...")
-    for ticker in STOCK_TICKERS:
-        try:
-            stock_inserted = stock_api.get_stock_data(
-                ticker=ticker,
-                max_items=MAX_ITEMS_PER_RUN,
-                db_name=UNIFIED_DB,
-                api_key_path=STOCK_API_KEY_PATH
-            )
-            print(f"Stock {ticker}: +{stock_inserted} records")
-        except Exception as e:
-            print(f"Error processing stock data for {ticker}: {e}")
+    try:
+        stock_results = stock_api.get_stock_data_many(
+            tickers=STOCK_TICKERS,
+            max_items=MAX_ITEMS_PER_RUN,
+            db_name=UNIFIED_DB,
+            api_key_path=STOCK_API_KEY_PATH
+        )
+        for ticker, stock_inserted in stock_results.items():
+            if isinstance(stock_inserted, Exception):
+                print(f"Error processing stock data for {ticker}: {stock_inserted}")
+            else:
+                print(f"Stock {ticker}: +{stock_inserted} records")
+    except Exception as e:
+        print(f"Error processing stock data: {e}")
     
     # Process news data
     print("\nProcessing news data...")
@@ -186,14 +189,8 @@ def main():
     if process_data():
         # Get the run count from any of the modules to determine if this is the fourth run
         # We'll use the sentiment module's run count
-        import json
-        if os.path.exists('sentiment_progress.json'):
-            with open('sentiment_progress.json', 'r') as f:
-                progress = json.load(f)
-                run_count = progress.get("run_count", 0)
-        else:
-            run_count = 0
-            
+        run_count = sentiment_api.get_run_count(UNIFIED_DB)
+        
         # Generate results (on fourth run or later)
         if run_count >= 4:
             generate_results()
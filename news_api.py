@@ -9,6 +9,7 @@ import requests
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from api_keys import get_news_api_key
+from database import connect_db
 
 # Database and API information
 DB_NAME = 'stock_and_news.db'
@@ -29,7 +30,7 @@ def create_news_tables(db_name):
     Args:
         db_name (str): Name of the SQLite database file.
     """
-    conn = sqlite3.connect(db_name)
+    conn = connect_db(db_name)
     cur = conn.cursor()
     
     # Articles table with composite uniqueness on title and pub_date
@@ -58,6 +59,28 @@ def create_news_tables(db_name):
         );
     """)
     
+    # Check which indexes exist before creating them
+    existing_indexes = {row[0] for row in cur.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'"
+    )}
+    
+    # Partial covering index over scored articles: counting them and joining
+    # scores to articles never touches the sentiment table itself
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sentiment_score
+        ON sentiment(article_id, score) WHERE score IS NOT NULL;
+    """)
+    
+    # Covering index for the monthly GROUP BY year, month joins on articles
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_articles_ym
+        ON articles(year, month, id);
+    """)
+    
+    # Refresh planner statistics once, when the indexes are first built
+    if not {'idx_sentiment_score', 'idx_articles_ym'} <= existing_indexes:
+        cur.execute("ANALYZE")
+    
     conn.commit()
     conn.close()
 
@@ -133,7 +156,7 @@ def insert_news_articles(articles, db_name, max_items):
     # Limit to max_items
     articles_to_insert = articles[:max_items]
     
-    conn = sqlite3.connect(db_name)
+    conn = connect_db(db_name)
     cur = conn.cursor()
     
     inserted = 0
@@ -280,7 +303,7 @@ def count_news_records(db_name):
     Returns:
         int: Total number of records.
     """
-    conn = sqlite3.connect(db_name)
+    conn = connect_db(db_name)
     cur = conn.cursor()
     
     try:
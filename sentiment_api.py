@@ -4,36 +4,99 @@ Uses Google Cloud Natural Language API to analyze sentiment.
 """
 import os
 import json
+import asyncio
 import sqlite3
 import google.auth
 from google.cloud import language_v2
+from database import connect_db
 
 # Database information
 DB_NAME = 'stock_and_news.db'
-PROGRESS_FILE = 'sentiment_progress.json'
+PROGRESS_FILE = 'sentiment_progress.json'  # Legacy progress file, read once for migration
 MAX_ITEMS_PER_RUN = 25  # Maximum items to process per run
+MAX_CONCURRENT_REQUESTS = 16  # Maximum sentiment API calls in flight at once
 
-def load_progress():
+# Statement used for every sentiment update, prepared once per run
+UPDATE_SENTIMENT_SQL = """
+    UPDATE sentiment
+    SET score = ?, magnitude = ?
+    WHERE article_id = ?
+"""
+
+# Characters TRIM strips from article text: space, tab, newline, carriage return
+WHITESPACE_SQL = "' ' || char(9, 10, 13)"
+
+def create_progress_table(cur):
+    """
+    Create the table holding sentiment analysis progress.
+    
+    Args:
+        cur (sqlite3.Cursor): Database cursor.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sentiment_progress (
+            key TEXT PRIMARY KEY,
+            val INTEGER
+        );
+    """)
+
+def load_progress(cur):
     """
-    Load sentiment analysis progress from JSON file.
+    Load sentiment analysis progress from the database.
     
+    Progress saved by older versions in PROGRESS_FILE is picked up the
+    first time the table is empty.
+    
+    Args:
+        cur (sqlite3.Cursor): Database cursor.
+        
     Returns:
         dict: Progress state dictionary.
     """
-    if os.path.exists(PROGRESS_FILE):
+    create_progress_table(cur)
+    cur.execute("SELECT key, val FROM sentiment_progress")
+    stored = dict(cur.fetchall())
+    
+    if not stored and os.path.exists(PROGRESS_FILE):
         with open(PROGRESS_FILE, 'r') as f:
-            return json.load(f)
-    return {"last_processed_id": 0, "run_count": 0}
+            stored = json.load(f)
+    
+    state = {"last_processed_id": 0, "run_count": 0}
+    state.update(stored)
+    return state
 
-def save_progress(state):
+def save_progress(cur, state):
     """
-    Save sentiment analysis progress to JSON file.
+    Save sentiment analysis progress to the database.
+    
+    The write joins the caller's open transaction, so progress is committed
+    together with the sentiment updates it describes.
     
     Args:
+        cur (sqlite3.Cursor): Database cursor.
         state (dict): Progress state dictionary.
     """
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump(state, f)
+    cur.executemany("""
+        INSERT INTO sentiment_progress (key, val) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET val = excluded.val
+    """, state.items())
+
+def get_run_count(db_name):
+    """
+    Get the number of completed sentiment analysis runs.
+    
+    Args:
+        db_name (str): Database file name.
+        
+    Returns:
+        int: Number of runs recorded so far.
+    """
+    conn = connect_db(db_name)
+    cur = conn.cursor()
+    run_count = load_progress(cur).get("run_count", 0)
+    conn.commit()
+    conn.close()
+    return run_count
 
 def build_text_for_analysis(title, description, snippet):
     """
@@ -58,36 +121,28 @@ def build_text_for_analysis(title, description, snippet):
     # Join with double newlines
     return "\n\n".join(parts)
 
-def analyze_sentiment(text):
+async def analyze_sentiment_async(client, text):
     """
-    Analyze sentiment of text using Google Cloud Natural Language API.
+    Analyze sentiment of text using the asynchronous Natural Language client.
     
     Args:
+        client (LanguageServiceAsyncClient): Shared asynchronous API client.
         text (str): Text to analyze.
         
     Returns:
         tuple: (score, magnitude) sentiment values.
-        
-    Note:
-        Requires Google Cloud credentials set up in environment.
     """
     try:
-        # Initialize the client
-        client = language_v2.LanguageServiceClient()
-        
-        # Prepare the document
         document = language_v2.Document(
             content=text,
             type_=language_v2.Document.Type.PLAIN_TEXT,
             language_code="en"
         )
         
-        # Analyze sentiment
-        response = client.analyze_sentiment(
+        response = await client.analyze_sentiment(
             request={"document": document, "encoding_type": language_v2.EncodingType.UTF8}
         )
         
-        # Get document sentiment
         sentiment = response.document_sentiment
         return sentiment.score, sentiment.magnitude
         
@@ -95,6 +150,37 @@ def analyze_sentiment(text):
         print(f"Error analyzing sentiment: {e}")
         return 0.0, 0.0  # Neutral sentiment on failure
 
+async def analyze_texts(texts, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    """
+    Analyze sentiment for several texts concurrently.
+    
+    A single client (and its underlying channel) is shared by every request,
+    and a semaphore caps how many requests are in flight at once.
+    
+    Args:
+        texts (list): Texts to analyze.
+        max_concurrency (int): Maximum number of simultaneous API calls.
+        
+    Returns:
+        list: (score, magnitude) tuples in the same order as texts.
+    """
+    try:
+        client = language_v2.LanguageServiceAsyncClient()
+    except Exception as e:
+        # e.g. missing credentials: score every text as neutral, like a failed call
+        print(f"Error analyzing sentiment: {e}")
+        return [(0.0, 0.0)] * len(texts)
+    
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def worker(text):
+        async with semaphore:
+            return await analyze_sentiment_async(client, text)
+    
+    # Close the client's channel before the event loop shuts down
+    async with client:
+        return await asyncio.gather(*(worker(text) for text in texts))
+
 def process_sentiment(db_name, max_items):
     """
     Process sentiment for news articles without sentiment scores.
@@ -111,75 +197,70 @@ def process_sentiment(db_name, max_items):
     Returns:
         int: Number of articles processed.
     """
-    # Load progress
-    progress = load_progress()
-    last_id = progress.get("last_processed_id", 0)
-    run_count = progress.get("run_count", 0)
-    
-    conn = sqlite3.connect(db_name)
-    cur = conn.cursor()
-    
-    # Determine query limit based on run count
-    if run_count < 3:
-        # For runs 0-2, limit to max_items
-        limit_clause = f"LIMIT {max_items}"
-    else:
-        # For run 3 and beyond, no limit - process all remaining items
-        limit_clause = ""
-    
-    # Find articles that need sentiment analysis
-    cur.execute(f"""
-        SELECT a.id, a.title, a.description, a.snippet 
-        FROM articles a
-        JOIN sentiment s ON a.id = s.article_id
-        WHERE s.score IS NULL AND a.id > ?
-        ORDER BY a.id
-        {limit_clause}
-    """, (last_id,))
-    
-    articles = cur.fetchall()
-    processed = 0
-    highest_id = last_id  # Track the highest ID we've processed
-    
-    for article in articles:
-        article_id, title, description, snippet = article
-        
-        # Build text for analysis
-        text = build_text_for_analysis(title, description, snippet)
-        
-        if not text:
-            # Skip if no text to analyze, but still update highest_id
-            highest_id = max(highest_id, article_id)
-            continue
-            
-        try:
-            # Analyze sentiment
-            score, magnitude = analyze_sentiment(text)
-            
-            # Update sentiment in database
-            cur.execute("""
-                UPDATE sentiment 
-                SET score = ?, magnitude = ?
-                WHERE article_id = ?
-            """, (score, magnitude, article_id))
-            
-            processed += 1
-            highest_id = max(highest_id, article_id)
-            
-        except Exception as e:
-            print(f"Error processing article {article_id}: {e}")
-            # Still update highest_id even if analysis fails
-            highest_id = max(highest_id, article_id)
-    
-    # Only update progress if we processed something or found articles
-    if processed > 0 or articles:
-        # Update progress to the highest ID we've seen and increment run count
-        progress["last_processed_id"] = highest_id
-        progress["run_count"] = run_count + 1
-        save_progress(progress)
-    
-    conn.commit()
-    conn.close()
+    conn = connect_db(db_name)
+    try:
+        cur = conn.cursor()
+        
+        # Load progress
+        progress = load_progress(cur)
+        last_id = progress.get("last_processed_id", 0)
+        run_count = progress.get("run_count", 0)
+        
+        # Determine query limit based on run count
+        if run_count < 3:
+            # For runs 0-2, limit to max_items
+            limit_clause = f"LIMIT {max_items}"
+        else:
+            # For run 3 and beyond, no limit - process all remaining items
+            limit_clause = ""
+        
+        # Find articles that need sentiment analysis and have some text to analyze
+        # (TRIM strips tabs and newlines as well as spaces, like str.strip)
+        cur.execute(f"""
+            SELECT a.id, a.title, a.description, a.snippet 
+            FROM articles a
+            JOIN sentiment s ON a.id = s.article_id
+            WHERE s.score IS NULL AND a.id > ?
+              AND (COALESCE(TRIM(a.title, {WHITESPACE_SQL}), '') <> ''
+                   OR COALESCE(TRIM(a.description, {WHITESPACE_SQL}), '') <> ''
+                   OR COALESCE(TRIM(a.snippet, {WHITESPACE_SQL}), '') <> '')
+            ORDER BY a.id
+            {limit_clause}
+        """, (last_id,))
+        
+        articles = cur.fetchall()
+        
+        # Rows are ordered by id, so the last one is the highest ID we've processed
+        highest_id = articles[-1][0] if articles else last_id
+        
+        # Build text for analysis, skipping any article left with no text
+        pending = [
+            (article_id, text)
+            for article_id, title, description, snippet in articles
+            if (text := build_text_for_analysis(title, description, snippet))
+        ]
+        
+        # Analyze all pending articles concurrently
+        results = asyncio.run(analyze_texts([text for _, text in pending])) if pending else []
+        
+        # Update sentiment in database, reusing one prepared statement for every row
+        cur.executemany(UPDATE_SENTIMENT_SQL, (
+            (score, magnitude, article_id)
+            for (article_id, _), (score, magnitude) in zip(pending, results)
+        ))
+        processed = len(results)
+        
+        # Only update progress if we processed something or found articles
+        if processed > 0 or articles:
+            # Update progress to the highest ID we've seen and increment run count
+            progress["last_processed_id"] = highest_id
+            progress["run_count"] = run_count + 1
+            save_progress(cur, progress)
+        
+        # Commit sentiment updates and progress together
+        conn.commit()
+    finally:
+        conn.close()
     
     return processed
 
@@ -193,17 +274,17 @@ def count_sentiment_records(db_name):
     Returns:
         tuple: (analyzed_count, total_count) counts.
     """
-    conn = sqlite3.connect(db_name)
+    conn = connect_db(db_name)
     cur = conn.cursor()
     
     try:
-        # Count total articles
-        cur.execute("SELECT COUNT(*) FROM articles")
-        total = cur.fetchone()[0]
-        
-        # Count articles with sentiment
-        cur.execute("SELECT COUNT(*) FROM sentiment WHERE score IS NOT NULL")
-        analyzed = cur.fetchone()[0]
+        # Count total articles and articles with sentiment in one query
+        cur.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM articles),
+                (SELECT COUNT(*) FROM sentiment WHERE score IS NOT NULL)
+        """)
+        total, analyzed = cur.fetchone()
         
     except sqlite3.OperationalError:
         # Tables don't exist
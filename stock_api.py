@@ -2,13 +2,58 @@
 Stock data API module for fetching stock market data from Alpha Vantage.
 This module handles fetching, processing, and storing stock data in SQLite database.
 """
+import io
+import os
+import json
+import time
+import hashlib
 import sqlite3
+import tempfile
 import requests
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from api_keys import get_stock_api_key
+from database import get_connection, stock_table_name
 
-# Database information
+# Database and API information
 DB_NAME = 'stock_and_news.db'
-TABLE_NAME_TEMPLATE = "{}_weekly_adjusted"
+BASE_URL = "https://www.alphavantage.co/query"
+REQUEST_TIMEOUT = 30  # Seconds to wait for an API response
+MAX_FETCH_WORKERS = 5  # Maximum tickers fetched from the API at once
+MAX_ROWS_PER_INSERT = 120  # 120 rows x 8 columns stays under SQLite's 999 parameter limit
+STOCK_FUNCTION = "TIME_SERIES_WEEKLY_ADJUSTED"
+
+# On-disk cache of API responses (weekly data changes at most once a week)
+CACHE_DIR = '.alpha_cache'
+CACHE_TTL = 6 * 60 * 60  # Seconds a cached response stays valid
+
+# Shared HTTP session so repeated API calls reuse the same connection
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.5)
+))
+
+# Mapping of API CSV headers to table columns, and the type of each price column
+CSV_COLUMNS = {
+    "timestamp": "date",
+    "adjusted close": "adjusted_close",
+    "dividend amount": "dividend_amount",
+}
+PRICE_DTYPES = {
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+    "adjusted_close": "float64",
+    "volume": "int64",
+    "dividend_amount": "float64",
+}
+STOCK_COLUMNS = ["date", *PRICE_DTYPES]
 
 def create_stock_tables(db_name, ticker):
     """
@@ -21,16 +66,16 @@ def create_stock_tables(db_name, ticker):
     Returns:
         str: The name of the created table.
     """
-    table_name = TABLE_NAME_TEMPLATE.format(ticker)
+    table_name = stock_table_name(ticker)
     
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cur = conn.cursor()
 
     # Main time series table
     cur.execute(f"""
-        CREATE TABLE IF NOT EXISTS {table_name} (
+        CREATE TABLE IF NOT EXISTS "{table_name}" (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT UNIQUE,
+            date TEXT NOT NULL UNIQUE,
             open REAL,
             high REAL,
             low REAL,
@@ -51,42 +96,136 @@ def create_stock_tables(db_name, ticker):
     """)
 
     conn.commit()
-    conn.close()
     
     return table_name
 
+def get_cache_path(function, symbol):
+    """
+    Get the cache file path for an API response.
+    
+    Responses are keyed by API function, symbol and ISO week, so a new
+    week always triggers a fresh download.
+    
+    Args:
+        function (str): Alpha Vantage API function name.
+        symbol (str): Stock ticker symbol.
+        
+    Returns:
+        str: Path to the cache file.
+    """
+    year, week, _ = datetime.now().isocalendar()
+    key = hashlib.sha1(f"{function}|{symbol}|{year}-W{week:02d}".encode()).hexdigest()
+    return os.path.join(CACHE_DIR, key + ".csv")
+
+def load_cached_response(path):
+    """
+    Load a cached API response if it exists and has not expired.
+    
+    Args:
+        path (str): Path to the cache file.
+        
+    Returns:
+        bytes: Cached response body, or None on a cache miss.
+    """
+    try:
+        if time.time() - os.path.getmtime(path) < CACHE_TTL:
+            with open(path, 'rb') as f:
+                return f.read()
+    except OSError:
+        # Missing or unreadable cache file
+        pass
+    return None
+
+def save_cached_response(path, content):
+    """
+    Save an API response to the cache.
+    
+    The file is written to a temporary name first and then moved into
+    place, so readers never see a partially written response. Expired
+    responses are never read again, so they are removed at the same time.
+    
+    Args:
+        path (str): Path to the cache file.
+        content (bytes): Response body to cache.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    
+    # Remove expired responses
+    now = time.time()
+    for entry in os.scandir(CACHE_DIR):
+        if not entry.name.endswith('.csv'):
+            continue
+        try:
+            if now - entry.stat().st_mtime >= CACHE_TTL:
+                os.remove(entry.path)
+        except OSError:
+            # Already removed by another thread
+            pass
+
+def parse_stock_csv(content):
+    """
+    Parse an Alpha Vantage CSV response into a typed DataFrame.
+    
+    Args:
+        content (bytes): CSV response body.
+        
+    Returns:
+        DataFrame: Stock data with one column per table column.
+    """
+    df = pd.read_csv(io.BytesIO(content), dtype={"timestamp": str})
+    df = df.rename(columns=CSV_COLUMNS)
+    
+    missing = [column for column in STOCK_COLUMNS if column not in df.columns]
+    if missing:
+        raise KeyError(f"Expected columns {missing} in API response.")
+    
+    return df[STOCK_COLUMNS].astype(PRICE_DTYPES)
+
 def fetch_stock_data(ticker, api_key_path):
     """
     Fetch weekly adjusted time series data from Alpha Vantage API.
+    Data is requested as CSV, and responses are cached on disk for CACHE_TTL seconds.
     
     Args:
         ticker (str): Stock ticker symbol.
         api_key_path (str): Path to file containing API key.
         
     Returns:
-        dict: JSON data from the API or raises an exception on failure.
+        DataFrame: Stock data from the API or raises an exception on failure.
     """
+    cache_path = get_cache_path(STOCK_FUNCTION, ticker)
+    content = load_cached_response(cache_path)
+    if content is not None:
+        return parse_stock_csv(content)
+    
     api_key = get_stock_api_key(api_key_path)
     
-    url = "https://www.alphavantage.co/query"
     params = {
-        "function": "TIME_SERIES_WEEKLY_ADJUSTED",
+        "function": STOCK_FUNCTION,
         "symbol": ticker,
         "apikey": api_key,
-        "datatype": "json"
+        "datatype": "csv"
     }
-    response = requests.get(url, params=params)
+    response = SESSION.get(BASE_URL, params=params, timeout=REQUEST_TIMEOUT)
     if response.status_code != 200:
         raise Exception(f"API request failed: {response.status_code} - {response.text}")
 
-    data = response.json()
-    if "Weekly Adjusted Time Series" not in data:
+    content = response.content
+    if content.lstrip().startswith(b"{"):
+        # Errors and rate limit messages are returned as JSON even for CSV requests
+        data = json.loads(content)
         if "Note" in data:
             # API limit reached
             raise Exception(f"API limit reached: {data['Note']}")
-        raise KeyError("Expected 'Weekly Adjusted Time Series' in API response.")
+        raise Exception(f"API request failed: {data}")
     
-    return data
+    df = parse_stock_csv(content)
+    save_cached_response(cache_path, content)
+    return df
 
 def insert_stock_data(data, db_name, ticker, max_items):
     """
@@ -98,7 +237,7 @@ def insert_stock_data(data, db_name, ticker, max_items):
       without limiting to max_items, ensuring the complete stock history is stored
     
     Args:
-        data (dict): API response data containing time series.
+        data (DataFrame): Stock data returned by fetch_stock_data.
         db_name (str): Database file name.
         ticker (str): Stock ticker symbol.
         max_items (int): Maximum number of items to insert in one run (only applies to first three runs).
@@ -106,97 +245,68 @@ def insert_stock_data(data, db_name, ticker, max_items):
     Returns:
         int: Number of new records inserted.
     """
-    table_name = TABLE_NAME_TEMPLATE.format(ticker)
+    table_name = stock_table_name(ticker)
     
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cur = conn.cursor()
 
     # Retrieve last processed date and run count
     cur.execute("SELECT last_date_processed, run_count FROM fetch_state_stocks WHERE table_name = ?", 
                 (table_name,))
     row = cur.fetchone()
-    last_date = row[0] if row else None
     run_count = row[1] if row and row[1] is not None else 0
 
-    ts = data["Weekly Adjusted Time Series"]
-    dates = sorted(ts.keys())  # Sort chronologically (oldest first)
-    
-    # Determine chunk to insert
-    chunk = []
+    # Determine chunk to insert: the earliest dates not yet in the table,
+    # in chronological order (ISO dates sort lexicographically). Rows are
+    # always inserted oldest first, so everything up to the newest stored
+    # date is already in the table.
+    cur.execute(f'SELECT MAX(date) FROM "{table_name}"')
+    max_date = cur.fetchone()[0] or ''
+    # After the third run, all remaining data from the API response is inserted.
+    chunk = data[data["date"] > max_date].sort_values("date")
     if run_count < 3:
-        # For first three runs, insert earliest 25 values
-        existing_dates = set()
-        cur.execute(f"SELECT date FROM {table_name}")
-        for row in cur.fetchall():
-            existing_dates.add(row[0])
+        # For first three runs, insert earliest max_items values
+        chunk = chunk.head(max_items)
         
-        for date in dates:
-            if date not in existing_dates:
-                chunk.append(date)
-                if len(chunk) >= max_items:
-                    break
-    else:
-        # After third run, insert all remaining data from the API response
-        # This ensures on the 4th run we get the complete stock history without limiting to max_items
-        existing_dates = set()
-        cur.execute(f"SELECT date FROM {table_name}")
-        for row in cur.fetchall():
-            existing_dates.add(row[0])
-            
-        for date in dates:
-            if date not in existing_dates:
-                chunk.append(date)
-    
-    # If we have too many, limit to max_items only for the first three runs
-    if run_count < 3 and len(chunk) > max_items:
-        chunk = chunk[:max_items]
-        
-    if not chunk:
-        conn.close()
+    if chunk.empty:
         return 0
         
-    # Insert records
-    inserted = 0
-    for date in chunk:
-        record = ts[date]
-        cur.execute(f"""
-            INSERT INTO {table_name}
-            (date, open, high, low, close, adjusted_close, volume, dividend_amount)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-            date,
-            float(record["1. open"]),
-            float(record["2. high"]),
-            float(record["3. low"]),
-            float(record["4. close"]),
-            float(record["5. adjusted close"]),
-            int(record["6. volume"]),
-            float(record["7. dividend amount"])
-        ))
-        inserted += 1
+    rows = list(chunk.itertuples(index=False, name=None))
+    columns_per_row = len(STOCK_COLUMNS)
 
     # Update fetch_state with new run_count
     new_run_count = run_count + 1
-    new_last_date = chunk[-1] if chunk else last_date
-    
-    # If this is the 4th run or later and we didn't insert anything, 
-    # still increment the run_count to avoid getting stuck
-    if run_count >= 3 and not inserted:
-        print(f"No more data available to insert for {ticker} after run {run_count+1}.")
-    
-    if row:
-        cur.execute(
-            "UPDATE fetch_state_stocks SET last_date_processed = ?, run_count = ? WHERE table_name = ?",
-            (new_last_date, new_run_count, table_name)
-        )
-    else:
-        cur.execute(
-            "INSERT INTO fetch_state_stocks (table_name, last_date_processed, run_count) VALUES (?, ?, ?)",
-            (table_name, new_last_date, new_run_count)
-        )
+    new_last_date = chunk["date"].iloc[-1]
 
-    conn.commit()
-    conn.close()
+    # Insert the records and the updated fetch state in one transaction;
+    # the connection commits on success and rolls back on any error
+    with conn:
+        # Insert up to MAX_ROWS_PER_INSERT rows per multi-row INSERT statement
+        inserted = 0
+        for start in range(0, len(rows), MAX_ROWS_PER_INSERT):
+            batch = rows[start:start + MAX_ROWS_PER_INSERT]
+            placeholders = ", ".join(["(" + ", ".join(["?"] * columns_per_row) + ")"] * len(batch))
+            inserted += conn.execute(f"""
+                INSERT OR IGNORE INTO "{table_name}"
+                (date, open, high, low, close, adjusted_close, volume, dividend_amount)
+                VALUES {placeholders}
+                """, [value for row in batch for value in row]).rowcount
+    
+        # If this is the 4th run or later and we didn't insert anything, 
+        # still increment the run_count to avoid getting stuck
+        if run_count >= 3 and not inserted:
+            print(f"No more data available to insert for {ticker} after run {run_count+1}.")
+    
+        if row:
+            conn.execute(
+                "UPDATE fetch_state_stocks SET last_date_processed = ?, run_count = ? WHERE table_name = ?",
+                (new_last_date, new_run_count, table_name)
+            )
+        else:
+            conn.execute(
+                "INSERT INTO fetch_state_stocks (table_name, last_date_processed, run_count) VALUES (?, ?, ?)",
+                (table_name, new_last_date, new_run_count)
+            )
     
     return inserted
 
@@ -225,6 +335,47 @@ def get_stock_data(ticker, max_items, db_name, api_key_path):
     
     return inserted
 
+def get_stock_data_many(tickers, max_items, db_name, api_key_path):
+    """
+    Fetch and store stock data for several tickers.
+    
+    API requests for all tickers run concurrently in a thread pool, while
+    the database inserts happen one at a time in the calling thread as each
+    response arrives.
+    
+    Args:
+        tickers (list): Stock ticker symbols.
+        max_items (int): Maximum number of items to insert in first three runs.
+        db_name (str): Database file name.
+        api_key_path (str): Path to file containing API key.
+        
+    Returns:
+        dict: Ticker mapped to the number of new records inserted, or to the
+            exception raised while fetching or storing its data.
+    """
+    results = {}
+    
+    # Set up each ticker's table first; a ticker that fails here is not fetched
+    ready_tickers = []
+    for ticker in tickers:
+        try:
+            create_stock_tables(db_name, ticker)
+            ready_tickers.append(ticker)
+        except Exception as e:
+            results[ticker] = e
+    
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as pool:
+        futures = {pool.submit(fetch_stock_data, ticker, api_key_path): ticker for ticker in ready_tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                results[ticker] = insert_stock_data(future.result(), db_name, ticker, max_items)
+            except Exception as e:
+                results[ticker] = e
+    
+    # Report results in the order the tickers were given
+    return {ticker: results[ticker] for ticker in tickers}
+
 def count_stock_records(ticker, db_name):
     """
     Count the total number of stock records for a ticker.
@@ -236,19 +387,18 @@ def count_stock_records(ticker, db_name):
     Returns:
         int: Total number of records.
     """
-    table_name = TABLE_NAME_TEMPLATE.format(ticker)
+    table_name = stock_table_name(ticker)
     
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cur = conn.cursor()
     
     try:
-        cur.execute(f"SELECT COUNT(*) FROM {table_name}")
+        cur.execute(f'SELECT COUNT(*) FROM "{table_name}"')
         count = cur.fetchone()[0]
     except sqlite3.OperationalError:
         # Table doesn't exist
         count = 0
         
-    conn.close()
     return count
 
 if __name__ == "__main__":
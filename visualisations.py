@@ -2,121 +2,347 @@
 Visualisation module for creating charts and graphs from stock and news data.
 """
 import os
-import sqlite3
+import glob
+import pickle
+import hashlib
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from datetime import datetime
+from database import get_connection, stock_table_name
 
 # Output directory for visualisations and data
 OUTPUT_DIR = 'output'
+CACHE_DIR = os.path.join(OUTPUT_DIR, '.cache')
+MAX_PLOT_POINTS = 2400  # Longer series are downsampled before plotting
+
+# Render off-screen with the Agg backend; charts are only saved to files
+matplotlib.use("Agg")
+
+# Shared chart styling, set once instead of per axis on every chart
+matplotlib.rcParams.update({
+    "axes.grid": True,
+    "grid.alpha": 0.3,
+    "figure.autolayout": True,  # Lay out on draw instead of calling tight_layout
+    "date.converter": "concise",  # Compact date labels on every date axis
+    "savefig.dpi": 90,  # Screen resolution is enough for these charts
+    "agg.path.chunksize": 10000,  # Let Agg draw long lines in batches
+})
+
+# Figure reused by every chart, created on first use
+_figure = None
 
 def ensure_output_dir():
     """Create output directory if it doesn't exist."""
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
-def visualise_stock_price(db_name, ticker):
+def get_figure(width, height):
+    """
+    Get the shared figure, cleared and resized for a new chart.
+    
+    Reusing one figure avoids setting up a new canvas for every chart.
+    The figure is built directly on an Agg canvas, bypassing pyplot, so it
+    is never held in pyplot's global figure registry.
+    
+    Args:
+        width (float): Figure width in inches.
+        height (float): Figure height in inches.
+        
+    Returns:
+        Figure: Empty matplotlib figure.
+    """
+    global _figure
+    if _figure is None:
+        _figure = Figure()
+        FigureCanvasAgg(_figure)
+    _figure.clf()
+    _figure.set_size_inches(width, height)
+    return _figure
+
+def save_figure(fig, filename):
+    """
+    Save a figure as a PNG with fast, light compression.
+    
+    zlib level 1 encodes much faster than the default level 6 for only
+    slightly larger files, and the Software metadata entry is left out.
+    
+    Args:
+        fig (Figure): Figure to save.
+        filename (str): Output PNG path.
+    """
+    fig.savefig(filename, pil_kwargs={"compress_level": 1}, metadata={"Software": None})
+
+def downsample_lttb(x, y, n_out):
+    """
+    Pick the points of a series to keep using Largest-Triangle-Three-Buckets.
+    
+    The first and last points are always kept. Every other bucket keeps the
+    point forming the largest triangle with the previously kept point and the
+    average of the next bucket, which preserves the visual shape of the line.
+    
+    Args:
+        x (ndarray): X values as floats, in increasing order.
+        y (ndarray): Y values.
+        n_out (int): Number of points to keep.
+        
+    Returns:
+        ndarray: Indices of the points to keep, in increasing order.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    # Bucket edges for every point except the first and last
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        
+        # Twice the triangle area for every candidate in this bucket
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    
+    return indices
+
+def downsample_series(df, column):
+    """
+    Downsample a date-indexed DataFrame to at most MAX_PLOT_POINTS rows.
+    
+    Args:
+        df (DataFrame): Data indexed by date.
+        column (str): Column whose shape should be preserved.
+        
+    Returns:
+        DataFrame: The original rows if short enough, else an LTTB sample.
+    """
+    if len(df) <= MAX_PLOT_POINTS:
+        return df
+    x = df.index.asi8.astype(float)
+    keep = downsample_lttb(x, df[column].to_numpy(dtype=float), MAX_PLOT_POINTS)
+    return df.iloc[keep]
+
+def get_db_mtime(db_name):
+    """
+    Get the last modification time of a database, including its WAL file.
+    
+    In WAL mode, recent writes only touch the -wal file until a checkpoint,
+    so both files are checked.
+    
+    Args:
+        db_name (str): Database file name.
+        
+    Returns:
+        int: Latest modification time in nanoseconds.
+    """
+    paths = [db_name, db_name + '-wal']
+    return max(os.stat(path).st_mtime_ns for path in paths if os.path.exists(path))
+
+def is_up_to_date(filename, db_name):
+    """
+    Check whether a saved chart is newer than the database it was drawn from.
+    
+    Args:
+        filename (str): Path to the chart file.
+        db_name (str): Database file name.
+        
+    Returns:
+        bool: True if the chart exists and no data has changed since it was saved.
+    """
+    return os.path.exists(filename) and os.stat(filename).st_mtime_ns > get_db_mtime(db_name)
+
+def fetch_all_cached(conn, db_name, query):
+    """
+    Run a query, reusing the saved result if the database hasn't changed.
+    
+    Results are cached on disk keyed by the query text and the database
+    modification time; entries for older versions of the database are
+    removed when a new result is saved.
+    
+    Args:
+        conn (sqlite3.Connection): Open database connection.
+        db_name (str): Database file name.
+        query (str): SQL query to run.
+        
+    Returns:
+        list: Result rows as tuples.
+    """
+    query_key = hashlib.sha1(query.encode()).hexdigest()
+    cache_file = os.path.join(CACHE_DIR, f"{query_key}_{get_db_mtime(db_name)}.pkl")
+    
+    if os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    
+    rows = conn.execute(query).fetchall()
+    
+    # Write to a temporary file first so concurrent renders never read a partial cache
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(rows, f)
+    os.replace(tmp_file, cache_file)
+    
+    # Remove results saved for older versions of the database
+    for stale_file in glob.glob(os.path.join(CACHE_DIR, f"{query_key}_*.pkl")):
+        if stale_file != cache_file:
+            try:
+                os.remove(stale_file)
+            except FileNotFoundError:
+                # Already removed by another process
+                pass
+    
+    return rows
+
+def load_close_prices(conn, db_name, ticker):
+    """
+    Load weekly close prices for a ticker, reading only new rows from the database.
+    
+    Stock rows are only ever appended, so the prices loaded last time are
+    kept in a cache file and just the dates after them are queried. The cache
+    is only reused if the table still holds exactly the cached dates; if the
+    database was replaced or rebuilt, the whole series is read again.
+    
+    Args:
+        conn (sqlite3.Connection): Open database connection.
+        db_name (str): Database file name.
+        ticker (str): Stock ticker symbol.
+        
+    Returns:
+        DataFrame: Close prices indexed by parsed date, oldest first.
+    """
+    table_name = stock_table_name(ticker)
+    db_key = hashlib.sha1(os.path.abspath(db_name).encode()).hexdigest()[:12]
+    cache_file = os.path.join(CACHE_DIR, f"{db_key}_{table_name}.pkl")
+    
+    cached = pd.read_pickle(cache_file) if os.path.exists(cache_file) else None
+    
+    if cached is not None and not cached.empty:
+        # Check the table still has the same rows up to the last cached date
+        last_date = cached.index.max().strftime('%Y-%m-%d')
+        table_state = conn.execute(
+            f'SELECT COUNT(*), MAX(date) FROM "{table_name}" WHERE date <= ?',
+            (last_date,)
+        ).fetchone()
+        if table_state != (len(cached), last_date):
+            cached = None
+    
+    if cached is not None and not cached.empty:
+        # Only fetch rows newer than the cached data
+        query = f"""
+            SELECT date, close FROM "{table_name}"
+            WHERE date > ?
+            ORDER BY date
+        """
+        new_rows = pd.read_sql_query(query, conn, params=(last_date,),
+                                     index_col='date', parse_dates=['date'])
+        if new_rows.empty:
+            return cached
+        df = pd.concat([cached, new_rows])
+    else:
+        query = f"""
+            SELECT date, close FROM "{table_name}"
+            ORDER BY date
+        """
+        df = pd.read_sql_query(query, conn, index_col='date', parse_dates=['date'])
+    
+    # Write to a temporary file first so concurrent renders never read a partial cache
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_file)
+    os.replace(tmp_file, cache_file)
+    return df
+
+def visualise_stock_price(db_name, ticker, force=False):
     """
     Create a simple line chart of stock price over time.
     
     Args:
         db_name (str): Database file name.
         ticker (str): Stock ticker symbol.
+        force (bool): Redraw the chart even if it is newer than the database.
         
     Returns:
         str: Path to saved visualisation file.
     """
     ensure_output_dir()
+    filename = f"{OUTPUT_DIR}/{ticker}_stock_price.png"
     
-    # Connect to database
-    conn = sqlite3.connect(db_name)
+    # Skip the query and render if the data hasn't changed since the last save
+    if not force and is_up_to_date(filename, db_name):
+        return filename
     
-    # Get table name
-    table_name = f"{ticker}_weekly_adjusted"
+    # Get the shared database connection
+    conn = get_connection(db_name)
     
-    # Query data
-    query = f"""
-        SELECT date, close FROM {table_name}
-        ORDER BY date
-    """
+    # Load close prices into pandas DataFrame
+    df = load_close_prices(conn, db_name, ticker)
     
-    # Load data into pandas DataFrame
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    # Thin out long histories; the chart can't show more points than pixels
+    df = downsample_series(df, 'close')
     
-    # Convert date to datetime
-    df['date'] = pd.to_datetime(df['date'])
+    # Plot plain datetime64 arrays so matplotlib uses its numpy date converter;
+    # float32 is plenty of precision for pixel positions
+    dates = df.index.to_numpy(dtype='datetime64[D]')
+    close_values = df['close'].to_numpy(dtype=np.float32)
     
     # Create visualisation
-    plt.figure(figsize=(10, 5))
-    plt.plot(df['date'], df['close'])
-    plt.title(f'{ticker} Stock Close Price Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Close Price ($)')
-    plt.grid(True, alpha=0.3)
+    fig = get_figure(10, 5)
+    ax = fig.add_subplot()
+    ax.plot(dates, close_values)
+    ax.set_title(f'{ticker} Stock Close Price Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Close Price ($)')
     
     # Format the x-axis to show fewer dates (to avoid overcrowding)
-    plt.xticks(rotation=45)
-    
-    # Ensure layout fits well
-    plt.tight_layout()
+    ax.tick_params(axis='x', labelrotation=45)
     
     # Save visualisation
-    filename = f"{OUTPUT_DIR}/{ticker}_stock_price.png"
-    plt.savefig(filename)
-    plt.close()
+    save_figure(fig, filename)
     
     return filename
 
-def visualise_score_vs_stock(db_name, ticker):
+def visualise_score_vs_stock(db_name, ticker, force=False):
     """
     Create a comparison between sentiment scores and stock prices.
     
     Args:
         db_name (str): Database file name.
         ticker (str): Stock ticker symbol.
+        force (bool): Redraw the chart even if it is newer than the database.
         
     Returns:
         str: Path to saved visualisation file.
     """
     ensure_output_dir()
+    filename = f"{OUTPUT_DIR}/{ticker}_price_vs_sentiment.png"
     
-    # Connect to database
-    conn = sqlite3.connect(db_name)
-    
-    # First, get the date range of sentiment data
-    date_query = """
-        SELECT MIN(a.year) as min_year, MAX(a.year) as max_year
-        FROM articles a
-        JOIN sentiment s ON a.id = s.article_id
-        WHERE s.score IS NOT NULL
-    """
-    date_range = pd.read_sql_query(date_query, conn)
-    
-    if date_range.empty or pd.isna(date_range['min_year'].iloc[0]):
-        print("No sentiment data available.")
-        conn.close()
-        return None
-    
-    min_year = int(date_range['min_year'].iloc[0])
-    max_year = int(date_range['max_year'].iloc[0])
+    # Skip the query and render if the data hasn't changed since the last save
+    if not force and is_up_to_date(filename, db_name):
+        return filename
     
-    # Get stock data for the relevant years 
-    stock_query = f"""
-        SELECT 
-            date,
-            close
-        FROM {ticker}_weekly_adjusted
-        WHERE date >= '{min_year}-01-01' AND date <= '{max_year}-12-31'
-        ORDER BY date
-    """
-    stock_df = pd.read_sql_query(stock_query, conn)
+    # Get the shared database connection
+    conn = get_connection(db_name)
     
-    # Get sentiment data
+    # Get monthly sentiment data, dated to the middle of each month
     sentiment_query = """
         SELECT 
-            a.year,
-            a.month,
+            printf('%04d-%02d-15', a.year, a.month) as date,
             AVG(s.score) as avg_score
         FROM articles a
         JOIN sentiment s ON a.id = s.article_id
@@ -124,59 +350,63 @@ def visualise_score_vs_stock(db_name, ticker):
         GROUP BY a.year, a.month
         ORDER BY a.year, a.month
     """
-    sentiment_df = pd.read_sql_query(sentiment_query, conn)
-    conn.close()
+    # Small result: build typed columns directly instead of letting pandas infer them
+    rows = fetch_all_cached(conn, db_name, sentiment_query)
+    sentiment_df = pd.DataFrame(np.array(rows, dtype=[('date', 'datetime64[D]'), ('avg_score', 'f4')]))
+    
+    if sentiment_df.empty:
+        print("No sentiment data available.")
+        return None
+    
+    # Get stock data for the years covered by the sentiment data
+    min_year = sentiment_df['date'].iloc[0].year
+    max_year = sentiment_df['date'].iloc[-1].year
+    stock_df = load_close_prices(conn, db_name, ticker).loc[str(min_year):str(max_year)]
+    stock_df = downsample_series(stock_df, 'close')
     
     # Check if we have data
     if stock_df.empty or sentiment_df.empty:
         print("Not enough data for visualisation.")
         return None
     
-    # Create a date column in the sentiment dataframe
-    sentiment_df['date'] = pd.to_datetime(sentiment_df.apply(
-        lambda row: f"{int(row['year'])}-{int(row['month']):02d}-15", axis=1
-    ))
-    
-    # Convert stock dates to datetime
-    stock_df['date'] = pd.to_datetime(stock_df['date'])
+    # Pull the plotted values out as arrays once so matplotlib skips the Series layer,
+    # with dates as datetime64 so the numpy date converter is used and values as float32
+    stock_dates = stock_df.index.to_numpy(dtype='datetime64[D]')
+    close_values = stock_df['close'].to_numpy(dtype=np.float32)
+    sentiment_dates = sentiment_df['date'].to_numpy(dtype='datetime64[D]')
+    score_values = sentiment_df['avg_score'].to_numpy()
     
     # Create the line chart
-    plt.figure(figsize=(10, 5))
+    fig = get_figure(10, 5)
     
     # Plot stock price
-    plt.subplot(2, 1, 1)
-    plt.plot(stock_df['date'], stock_df['close'], 'b-', label='Stock Price')
-    plt.ylabel('Stock Price ($)')
-    plt.title(f'{ticker} Stock Price and News Sentiment')
-    plt.grid(True, alpha=0.3)
-    plt.legend()
+    ax1 = fig.add_subplot(2, 1, 1)
+    ax1.plot(stock_dates, close_values, 'b-', label='Stock Price')
+    ax1.set_ylabel('Stock Price ($)')
+    ax1.set_title(f'{ticker} Stock Price and News Sentiment')
+    ax1.legend()
     
     # Plot sentiment score
-    plt.subplot(2, 1, 2)
-    plt.plot(sentiment_df['date'], sentiment_df['avg_score'], 'r-', label='Sentiment Score')
-    plt.axhline(y=0, color='gray', linestyle='--', alpha=0.7)
-    plt.ylabel('Sentiment Score')
-    plt.xlabel('Date')
-    plt.grid(True, alpha=0.3)
-    plt.legend()
-    
-    # Ensure layout fits well
-    plt.tight_layout()
+    ax2 = fig.add_subplot(2, 1, 2)
+    ax2.plot(sentiment_dates, score_values, 'r-', label='Sentiment Score')
+    ax2.axhline(y=0, color='gray', linestyle='--', alpha=0.7)
+    ax2.set_ylabel('Sentiment Score')
+    ax2.set_xlabel('Date')
+    ax2.legend()
     
     # Save visualisation
-    filename = f"{OUTPUT_DIR}/{ticker}_price_vs_sentiment.png"
-    plt.savefig(filename)
-    plt.close()
+    save_figure(fig, filename)
     
     return filename
 
-def generate_all_visualisations(db_name, ticker):
+def generate_all_visualisations(db_name, ticker, force=False):
     """
     Generate all visualisations for the data.
     
     Args:
         db_name (str): Database file name.
         ticker (str): Stock ticker symbol.
+        force (bool): Redraw every chart, even ones newer than the database.
         
     Returns:
         list: Paths to generated visualisations.
@@ -184,18 +414,15 @@ def generate_all_visualisations(db_name, ticker):
     # Make sure output directory exists
     ensure_output_dir()
     
-    # List to collect paths to visualisations
-    visualisation_files = []
-    
-    # Generate the stock price line chart
-    stock_price_file = visualise_stock_price(db_name, ticker)
-    if stock_price_file:
-        visualisation_files.append(stock_price_file)
+    # Each chart is an independent query and render, so draw them in separate
+    # processes; every worker opens its own connection and figure
+    chart_functions = [visualise_stock_price, visualise_score_vs_stock]
+    with ProcessPoolExecutor(max_workers=len(chart_functions)) as executor:
+        futures = [executor.submit(func, db_name, ticker, force) for func in chart_functions]
+        results = [future.result() for future in futures]
     
-    # Generate the stock price vs sentiment score comparison
-    comparison_file = visualise_score_vs_stock(db_name, ticker)
-    if comparison_file:
-        visualisation_files.append(comparison_file)
+    # List to collect paths to visualisations
+    visualisation_files = [filename for filename in results if filename]
     
     return visualisation_files
 